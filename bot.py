@@ -1,21 +1,39 @@
+import asyncio
+import ssl
+import aiohttp
+import certifi
+import numpy as np
+import redis.asyncio as redis
 import ccxt
+import ccxt.pro as ccxtpro
 import time
+import math
+import random
 import json
 import os
-import math
+import sqlite3
+import socket
 import logging
+import logging.handlers
+import queue
+from dataclasses import dataclass
 from datetime import datetime
 
 # Set up logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("trading_bot.log"),
-        logging.StreamHandler()
-    ]
-)
+# Records are queued and written by a background listener so the trading loop never waits on I/O
+log_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+log_handlers = [
+    logging.FileHandler("trading_bot.log"),
+    logging.StreamHandler()
+]
+for handler in log_handlers:
+    handler.setFormatter(log_formatter)
+log_queue = queue.Queue(-1)
+log_listener = logging.handlers.QueueListener(log_queue, *log_handlers)
+
 logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+logger.addHandler(logging.handlers.QueueHandler(log_queue))
 
 # Configuration (replace with your own values)
 API_KEY = 'YOUR_API_KEY'
@@ -25,179 +43,591 @@ AMOUNT_TO_BUY = 5  # $5 worth of crypto
 PRICE_DROP_THRESHOLD = 0.05  # 5% drop
 PRICE_RISE_THRESHOLD = 0.10  # 10% rise
 COINS = ['BTC', 'TON', 'ETH', 'XRP', 'ADA', 'DOGE']
-CHECK_INTERVAL = 60  # Check prices every 60 seconds
+SYMBOLS = {coin: f"{coin}/USDT" for coin in COINS}  # Market symbol for each coin
+CHECK_INTERVAL = 60  # Log a status heartbeat every 60 seconds
+MARKETS_REFRESH_INTERVAL = 3600  # Reload market precisions every hour
+HTTP_POOL_SIZE = 16  # Keep-alive connections shared by all exchange requests
+REQUEST_RATE = 10  # Exchange requests allowed per second on average
+REQUEST_BURST = 20  # Requests allowed back-to-back before the rate applies
+LOAD_MARKETS_WEIGHT = 10  # Reloading markets is far heavier than a ticker or order request
+ORDER_QUEUE_SIZE = 64  # Order intents waiting for the order worker
+ORDER_DRAIN_TIMEOUT = 30  # Seconds to let queued orders finish on shutdown
+WATCH_ERROR_BACKOFF = 5  # Seconds to wait before watching again after an exchange error
 
-# File to store trading state
+# Errors worth retrying: the request may succeed if sent again shortly
+NETWORK_ERRORS = (ccxt.NetworkError, ccxt.RequestTimeout, ccxt.DDoSProtection)
+# Errors where an order was rejected before it could be filled, so it is safe to resend.
+# A timeout on an order may still have executed, so those are not retried.
+ORDER_RETRY_ERRORS = (ccxt.DDoSProtection,)
+
+# Redis server storing the trading state. Several bot processes can share it: each
+# order first takes a per-coin claim, so only one process trades a coin at a time.
+# Reference prices are last-writer-wins between processes.
+REDIS_URL = 'redis://localhost:6379/0'
+ORDER_CLAIM_TTL = 60  # Seconds before a crashed process's claim on a coin expires
+PROCESS_ID = f"{socket.gethostname()}:{os.getpid()}"  # Owner recorded on claims
+# Deletes a claim only if this process still owns it (it may have expired and been retaken)
+RELEASE_CLAIM_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+# Redis hashes (coin -> value) holding the persisted parts of the state
+STATE_KEYS = ('holdings', 'buy_prices', 'reference_prices')
+# State left by earlier versions, imported into an empty Redis on first run
+STATE_DB = 'state.db'
 STATE_FILE = 'trading_state.json'
 
-def initialize_exchange():
-    """Initialize the exchange connection."""
-    exchange_class = getattr(ccxt, EXCHANGE_ID)
+@dataclass(frozen=True, slots=True)
+class Config:
+    """Strategy settings, bound once so the trading loop reads them as attributes."""
+    drop: float  # Fractional price drop from reference that triggers a buy
+    rise: float  # Fractional price rise from buy price that triggers a sell
+    amount: float  # Quote currency (USDT) to spend per buy
+    interval: int  # Seconds between status heartbeats
+
+class TokenBucket:
+    """Token-bucket rate limiter that rejects calls instead of sleeping."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.ts = time.monotonic()
+
+    def try_consume(self, weight=1):
+        """Take weight tokens if available; return False if the call should be skipped."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.ts) * self.rate)
+        self.ts = now
+        if self.tokens < weight:
+            return False
+        self.tokens -= weight
+        return True
+
+# Shared by every REST call so a burst of orders can't push us over the exchange limit
+rate_limiter = TokenBucket(REQUEST_RATE, REQUEST_BURST)
+
+class RateLimitReached(Exception):
+    """Raised when rate_limiter has no tokens left for a request."""
+
+def create_http_session():
+    """Create a pooled HTTP session so requests reuse keep-alive connections."""
+    connector = aiohttp.TCPConnector(
+        limit=HTTP_POOL_SIZE,
+        ttl_dns_cache=300,
+        ssl=ssl.create_default_context(cafile=certifi.where()),
+        enable_cleanup_closed=True,
+    )
+    return aiohttp.ClientSession(connector=connector, trust_env=True)
+
+def initialize_exchange(session):
+    """Initialize the exchange connection (WebSocket-capable ccxt.pro client)."""
+    exchange_class = getattr(ccxtpro, EXCHANGE_ID)
     exchange = exchange_class({
         'apiKey': API_KEY,
         'secret': API_SECRET,
-        'enableRateLimit': True,
+        # Throttling is done by rate_limiter; ccxt's own limiter sleeps inside calls
+        'enableRateLimit': False,
+        'session': session,  # REST and WebSocket calls share our connection pool
     })
     return exchange
 
-def load_state():
-    """Load the trading state from file."""
+def open_state_store():
+    """Connect to the Redis server holding the trading state."""
+    return redis.Redis.from_url(REDIS_URL, decode_responses=True)
+
+def read_legacy_state():
+    """Read state saved by an earlier version, trying state.db then trading_state.json.
+    
+    Returns (source, state), or (None, None) if neither has anything to import.
+    """
+    if os.path.exists(STATE_DB):
+        db = sqlite3.connect(f"file:{STATE_DB}?mode=ro", uri=True)
+        try:
+            state = {key: {} for key in STATE_KEYS}
+            for coin, amount, buy_price in db.execute("SELECT coin, amount, buy_price FROM holdings"):
+                state['holdings'][coin] = amount
+                state['buy_prices'][coin] = buy_price
+            for coin, price in db.execute("SELECT coin, price FROM reference_prices"):
+                state['reference_prices'][coin] = price
+        finally:
+            db.close()
+        if any(state.values()):
+            return STATE_DB, state
+    
     if os.path.exists(STATE_FILE):
         with open(STATE_FILE, 'r') as f:
-            return json.load(f)
+            state = json.load(f)
+        state = {key: state.get(key, {}) for key in STATE_KEYS}
+        if any(state.values()):
+            return STATE_FILE, state
+    
+    return None, None
+
+async def load_state(store):
+    """Load the trading state from Redis into memory.
+    
+    If Redis holds no state yet, state saved by an earlier version is
+    imported first so open positions carry over.
+    """
+    # holdings: what we're currently holding (amount in coin)
+    # buy_prices: prices at which we bought
+    # reference_prices: reference prices for calculating drops
+    async with store.pipeline(transaction=True) as pipe:
+        for key in STATE_KEYS:
+            pipe.hgetall(key)
+        hashes = await pipe.execute()
+    
+    if not any(hashes):
+        source, legacy = read_legacy_state()
+        if legacy is not None:
+            # One MULTI/EXEC so a crash can't leave a half-imported state
+            async with store.pipeline(transaction=True) as pipe:
+                for key in STATE_KEYS:
+                    if legacy[key]:
+                        pipe.hset(key, mapping=legacy[key])
+                await pipe.execute()
+            logger.info(f"Imported trading state from {source}")
+            hashes = [legacy[key] for key in STATE_KEYS]
+    
+    return {
+        key: {coin: float(value) for coin, value in values.items()}
+        for key, values in zip(STATE_KEYS, hashes)
+    }
+
+def buy_trigger(reference_price, drop):
+    """Highest price at which (price - reference_price) / reference_price <= -drop.
+    
+    The product alone can land a rounding step off, so it is nudged to the
+    exact float boundary of the percentage check; a price that hits the
+    threshold exactly still triggers.
+    """
+    trigger = reference_price * (1 - drop)
+    while (trigger - reference_price) / reference_price > -drop:
+        trigger = math.nextafter(trigger, -math.inf)
+    while (math.nextafter(trigger, math.inf) - reference_price) / reference_price <= -drop:
+        trigger = math.nextafter(trigger, math.inf)
+    return trigger
+
+def sell_trigger(buy_price, rise):
+    """Lowest price at which (price - buy_price) / buy_price >= rise, see buy_trigger."""
+    trigger = buy_price * (1 + rise)
+    while (trigger - buy_price) / buy_price < rise:
+        trigger = math.nextafter(trigger, math.inf)
+    while (math.nextafter(trigger, -math.inf) - buy_price) / buy_price >= rise:
+        trigger = math.nextafter(trigger, -math.inf)
+    return trigger
+
+def build_triggers(state, cfg):
+    """Precompute the absolute prices at which each coin should be bought or sold."""
+    state['buy_triggers'] = {coin: buy_trigger(ref, cfg.drop) for coin, ref in state['reference_prices'].items()}
+    state['sell_triggers'] = {coin: sell_trigger(buy_price, cfg.rise) for coin, buy_price in state['buy_prices'].items()}
+
+async def save_reference_prices(store, prices):
+    """Persist reference prices for one or more coins in a single write."""
+    await store.hset('reference_prices', mapping=prices)
+
+async def save_trade(store, coin, side, amount, price):
+    """Persist a completed trade and the coin's new reference price atomically."""
+    # MULTI/EXEC so other processes never see holdings without a matching buy price
+    async with store.pipeline(transaction=True) as pipe:
+        if side == 'buy':
+            pipe.hset('holdings', coin, amount)
+            pipe.hset('buy_prices', coin, price)
+        else:
+            pipe.hdel('holdings', coin)
+            pipe.hdel('buy_prices', coin)
+        pipe.hset('reference_prices', coin, price)
+        await pipe.execute()
+
+async def claim_coin(store, state, cfg, coin):
+    """Claim a coin for trading across processes and refresh its holding from Redis.
+    
+    Returns False if another process is already trading the coin.
+    """
+    if not await store.set(f"order_claim:{coin}", PROCESS_ID, nx=True, ex=ORDER_CLAIM_TTL):
+        return False
+    
+    # Another process may have bought or sold the coin since we loaded the state
+    async with store.pipeline(transaction=True) as pipe:
+        pipe.hget('holdings', coin)
+        pipe.hget('buy_prices', coin)
+        amount, buy_price = await pipe.execute()
+    if amount is None:
+        state['holdings'].pop(coin, None)
+        state['buy_prices'].pop(coin, None)
+        state['sell_triggers'].pop(coin, None)
     else:
-        # Initialize with empty holdings and reference prices
-        state = {
-            'holdings': {},  # What we're currently holding (amount in coin)
-            'buy_prices': {},  # Prices at which we bought
-            'reference_prices': {},  # Reference prices for calculating drops
-        }
-        return state
-
-def save_state(state):
-    """Save the trading state to file."""
-    with open(STATE_FILE, 'w') as f:
-        json.dump(state, f, indent=4)
-
-def get_current_prices(exchange, coins):
+        state['holdings'][coin] = float(amount)
+        state['buy_prices'][coin] = float(buy_price)
+        state['sell_triggers'][coin] = sell_trigger(float(buy_price), cfg.rise)
+    return True
+
+async def release_coin(store, coin):
+    """Release this process's claim on a coin."""
+    await store.eval(RELEASE_CLAIM_SCRIPT, 1, f"order_claim:{coin}", PROCESS_ID)
+
+async def retry(fn, *, tries=3, base=0.5, errors=NETWORK_ERRORS, weight=1):
+    """Await fn(), retrying transient errors with exponential backoff and jitter.
+    
+    Every attempt is a request, so each one takes weight tokens from
+    rate_limiter and raises RateLimitReached if none are left. Use weight=0
+    for calls that don't hit the REST API.
+    """
+    for attempt in range(tries):
+        if weight and not rate_limiter.try_consume(weight):
+            raise RateLimitReached(f"Rate limit reached after {attempt} attempt(s)")
+        try:
+            return await fn()
+        except errors as e:
+            if attempt == tries - 1:
+                raise
+            delay = base * 2 ** attempt + random.random() * 0.1
+            logger.warning(f"Transient error: {e}. Retrying in {delay:.2f}s...")
+            await asyncio.sleep(delay)
+
+async def get_current_prices(exchange, coins):
     """Get current prices for all coins."""
     current_prices = {}
+    symbols = [SYMBOLS[coin] for coin in coins]
+    try:
+        # One request for all symbols instead of one round-trip per coin
+        tickers = await retry(lambda: exchange.fetch_tickers(symbols))
+    except RateLimitReached:
+        logger.warning("Rate limit reached, skipping price fetch")
+        return current_prices
+    except Exception as e:
+        logger.error(f"Error fetching prices for {', '.join(coins)}: {e}")
+        return current_prices
+
     for coin in coins:
-        try:
-            symbol = f"{coin}/USDT"
-            ticker = exchange.fetch_ticker(symbol)
-            current_prices[coin] = ticker['last']
-            logger.info(f"Current price of {coin}: ${current_prices[coin]}")
-        except Exception as e:
-            logger.error(f"Error fetching price for {coin}: {e}")
+        symbol = SYMBOLS[coin]
+        if symbol in tickers:
+            current_prices[coin] = tickers[symbol]['last']
+            logger.debug(f"Current price of {coin}: ${current_prices[coin]}")
+        else:
+            logger.error(f"No ticker returned for {coin}")
     return current_prices
 
+async def load_amount_precisions(exchange, coins):
+    """Load the markets once and return the amount precision for each coin."""
+    markets = await retry(lambda: exchange.load_markets(reload=True), weight=LOAD_MARKETS_WEIGHT)
+    precisions = {}
+    for coin in coins:
+        market = markets.get(SYMBOLS[coin])
+        if market is None:
+            # Delisted or renamed; the coin is skipped until a refresh finds it again
+            logger.error(f"No market found for {SYMBOLS[coin]}, not trading {coin}")
+            continue
+        precision = market['precision']['amount']
+        # Some exchanges require specific precision for amounts
+        precisions[coin] = precision if isinstance(precision, int) else 8
+    return precisions
+
 def round_amount(amount, precision):
-    """Round amount mathematically to the specified precision."""
-    factor = 10 ** precision
-    return math.floor(amount * factor + 0.5) / factor
+    """Round amount to the specified number of decimal places."""
+    return round(amount, precision)
+
+async def place_order(exchange, coin, side, amount):
+    """Place a market order for the given coin and return the exchange response.
+    
+    Returns None without placing the order if the rate limit is reached.
+    """
+    symbol = SYMBOLS[coin]
+    logger.info(f"Placing {side} order for {amount} {coin}")
+    if side == 'buy':
+        create_order = exchange.create_market_buy_order
+    else:
+        create_order = exchange.create_market_sell_order
+    try:
+        return await retry(lambda: create_order(symbol, amount), errors=ORDER_RETRY_ERRORS)
+    except RateLimitReached:
+        logger.warning(f"Rate limit reached, skipping {side} order for {coin}")
+        return None
 
-def check_trading_conditions(exchange, state, current_prices):
-    """Check if we should buy or sell based on price movements."""
+async def record_trade(state, store, cfg, coin, side, amount, price):
+    """Apply a completed trade to the in-memory state and persist it."""
+    if side == 'buy':
+        # Record the purchase
+        state['holdings'][coin] = amount
+        state['buy_prices'][coin] = price
+        state['sell_triggers'][coin] = sell_trigger(price, cfg.rise)
+    else:
+        # Remove from holdings after successful sell
+        del state['holdings'][coin]
+        del state['buy_prices'][coin]
+        del state['sell_triggers'][coin]
+    
+    # Reset reference price after every trade
+    state['reference_prices'][coin] = price
+    state['buy_triggers'][coin] = buy_trigger(price, cfg.drop)
+    await save_trade(store, coin, side, amount, price)
+
+async def execute_intent(exchange, state, store, cfg, side, coin, amount, price):
+    """Claim the coin, place the order and record it if it executes."""
+    claimed = False
+    try:
+        claimed = await claim_coin(store, state, cfg, coin)
+        if not claimed:
+            logger.info(f"Another process is trading {coin}, skipping {side} order")
+            return
+        
+        held = coin in state['holdings']
+        if held == (side == 'buy'):
+            logger.info(f"{coin} was already {'bought' if held else 'sold'} by another process, skipping {side} order")
+            return
+        if side == 'sell':
+            # Sell what Redis says we hold, not what this process last saw
+            amount = state['holdings'][coin]
+        
+        order = await place_order(exchange, coin, side, amount)
+        if order is None:
+            # Skipped by the rate limiter; the next price change re-evaluates it
+            return
+        logger.info(f"{side.capitalize()} order executed: {order}")
+        
+        try:
+            await record_trade(state, store, cfg, coin, side, amount, price)
+        except Exception as e:
+            # The order is real, so this must not read as a failed order
+            logger.error(f"{side.capitalize()} order {order.get('id')} for {amount} {coin} filled but not persisted: {e}")
+    except Exception as e:
+        logger.error(f"Error executing {side} order for {coin}: {e}")
+    finally:
+        if claimed:
+            try:
+                await release_coin(store, coin)
+            except Exception as e:
+                # The claim expires after ORDER_CLAIM_TTL anyway
+                logger.error(f"Error releasing claim on {coin}: {e}")
+
+async def order_worker(exchange, state, store, cfg, order_queue, pending):
+    """Place queued orders one at a time and record the ones that execute."""
+    while True:
+        side, coin, amount, price = await order_queue.get()
+        # Shielded so cancelling the worker can't abandon an order the exchange may
+        # already have filled before it is recorded
+        execution = asyncio.ensure_future(execute_intent(exchange, state, store, cfg, side, coin, amount, price))
+        try:
+            await asyncio.shield(execution)
+        except asyncio.CancelledError:
+            await execution
+            raise
+        finally:
+            pending.discard(coin)
+            order_queue.task_done()
+
+async def check_trading_conditions(state, store, current_prices, last_prices, cfg, precisions, order_queue, pending):
+    """Check if we should buy or sell based on price movements.
+    
+    Coins whose price hasn't changed since the last tick (tracked in
+    last_prices) are skipped. Prices are compared against the trigger
+    prices from build_triggers, which are kept in step with every reference
+    and buy price change. Every change to the in-memory state is written
+    through to Redis.
+    
+    Orders are not placed here: buy and sell intents are put on order_queue
+    for order_worker, and their coins are added to pending so they aren't
+    evaluated again until the order has completed.
+    """
+    holdings = state['holdings']
+    buy_prices = state['buy_prices']
+    refs = state['reference_prices']
+    buy_triggers = state['buy_triggers']
+    sell_triggers = state['sell_triggers']
+    new_refs = {}  # Reference prices to persist for this tick
+    
+    coins = []  # Coins with a new price and a reference to compare it against
     for coin, price in current_prices.items():
-        symbol = f"{coin}/USDT"
+        # Wait for the coin's in-flight order to complete before deciding again
+        if coin in pending:
+            continue
+        
+        # No market to trade it on (see load_amount_precisions)
+        if coin not in precisions:
+            continue
+        
+        # Nothing to decide if the price is the same as last tick
+        if last_prices.get(coin) == price:
+            continue
+        last_prices[coin] = price
         
         # Initialize reference price if we don't have one
-        if coin not in state['reference_prices']:
-            state['reference_prices'][coin] = price
+        if coin not in refs:
+            refs[coin] = price
+            buy_triggers[coin] = buy_trigger(price, cfg.drop)
+            new_refs[coin] = price
             continue
         
-        # If we're not holding this coin and price dropped by threshold or more from reference
-        if coin not in state['holdings']:
-            reference_price = state['reference_prices'][coin]
-            price_change = (price - reference_price) / reference_price
-            
-            if price_change <= -PRICE_DROP_THRESHOLD:
-                logger.info(f"Price of {coin} dropped by {-price_change*100:.2f}% from ${reference_price} to ${price}. Buying ${AMOUNT_TO_BUY} worth.")
-                
-                try:
-                    # Calculate amount to buy (in coin units)
-                    amount_in_coin = AMOUNT_TO_BUY / price
-                    
-                    # Some exchanges require specific precision for amounts
-                    markets = exchange.load_markets()
-                    market = markets[symbol]
-                    
-                    # Get the precision required by the exchange
-                    amount_precision = market['precision']['amount'] if isinstance(market['precision']['amount'], int) else 8
-                    
-                    # Round the amount mathematically to the required precision
-                    amount_in_coin = round_amount(amount_in_coin, amount_precision)
-                    
-                    logger.info(f"Placing buy order for {amount_in_coin} {coin} (${AMOUNT_TO_BUY})")
-                    order = exchange.create_market_buy_order(symbol, amount_in_coin)
-                    logger.info(f"Buy order executed: {order}")
-                    
-                    # Record the purchase
-                    state['holdings'][coin] = amount_in_coin
-                    state['buy_prices'][coin] = price
-                    
-                    # Reset reference price after buying
-                    state['reference_prices'][coin] = price
-                    
-                except Exception as e:
-                    logger.error(f"Error executing buy order for {coin}: {e}")
-            else:
-                # Update reference price if price is lower
-                if price < reference_price:
-                    state['reference_prices'][coin] = price
-                    logger.info(f"Updated reference price for {coin} to ${price}")
+        coins.append(coin)
+    
+    if not coins:
+        if new_refs:
+            await save_reference_prices(store, new_refs)
+        return
+    
+    # Evaluate the triggers for all coins at once; coins we don't hold have a NaN
+    # sell trigger, which never compares true
+    n = len(coins)
+    prices = np.fromiter((current_prices[coin] for coin in coins), float, n)
+    ref_prices = np.fromiter((refs[coin] for coin in coins), float, n)
+    buy_at = np.fromiter((buy_triggers[coin] for coin in coins), float, n)
+    sell_at = np.fromiter((sell_triggers.get(coin, np.nan) for coin in coins), float, n)
+    held = np.fromiter((coin in holdings for coin in coins), bool, n)
+    
+    buy_mask = ~held & (prices <= buy_at)
+    sell_mask = prices >= sell_at
+    lower_mask = ~held & ~buy_mask & (prices < ref_prices)
+    
+    # If we're not holding this coin and price dropped by threshold or more from reference
+    for i in np.flatnonzero(buy_mask):
+        coin = coins[i]
+        price = current_prices[coin]
+        ref = refs[coin]
+        logger.info(f"Price of {coin} dropped by {(ref - price) / ref * 100:.2f}% from ${ref} to ${price}. Buying ${cfg.amount} worth.")
         
-        # If we're holding this coin, check if price rose by threshold
-        else:
-            buy_price = state['buy_prices'][coin]
-            price_change = (price - buy_price) / buy_price
-            
-            if price_change >= PRICE_RISE_THRESHOLD:
-                logger.info(f"Price of {coin} rose by {price_change*100:.2f}% from ${buy_price} to ${price}. Selling all.")
-                
-                amount_to_sell = state['holdings'][coin]
-                
-                try:
-                    logger.info(f"Placing sell order for {amount_to_sell} {coin}")
-                    order = exchange.create_market_sell_order(symbol, amount_to_sell)
-                    logger.info(f"Sell order executed: {order}")
-                    
-                    # Remove from holdings after successful sell
-                    del state['holdings'][coin]
-                    del state['buy_prices'][coin]
-                    
-                    # Reset reference price for future buying opportunities
-                    state['reference_prices'][coin] = price
-                    
-                except Exception as e:
-                    logger.error(f"Error executing sell order for {coin}: {e}")
+        # Calculate amount to buy (in coin units), rounded to the required precision
+        amount_in_coin = round_amount(cfg.amount / price, precisions[coin])
+        pending.add(coin)
+        await order_queue.put(('buy', coin, amount_in_coin, price))
     
-    return state
+    # If we're holding this coin and price rose by threshold or more from buy price
+    for i in np.flatnonzero(sell_mask):
+        coin = coins[i]
+        price = current_prices[coin]
+        buy_price = buy_prices[coin]
+        logger.info(f"Price of {coin} rose by {(price - buy_price) / buy_price * 100:.2f}% from ${buy_price} to ${price}. Selling all.")
+        pending.add(coin)
+        await order_queue.put(('sell', coin, holdings[coin], price))
+    
+    # Otherwise track the lowest price seen as the new reference
+    for i in np.flatnonzero(lower_mask):
+        coin = coins[i]
+        price = current_prices[coin]
+        refs[coin] = price
+        buy_triggers[coin] = buy_trigger(price, cfg.drop)
+        new_refs[coin] = price
+        logger.debug(f"Updated reference price for {coin} to ${price}")
+    
+    if new_refs:
+        await save_reference_prices(store, new_refs)
 
-def main():
+async def main():
     """Main function to run the trading bot."""
+    log_listener.start()
     logger.info("Initializing trading bot...")
-    exchange = initialize_exchange()
-    state = load_state()
+    cfg = Config(
+        drop=PRICE_DROP_THRESHOLD,
+        rise=PRICE_RISE_THRESHOLD,
+        amount=AMOUNT_TO_BUY,
+        interval=CHECK_INTERVAL,
+    )
+    session = create_http_session()
+    exchange = initialize_exchange(session)
+    store = open_state_store()
+    order_queue = asyncio.Queue(maxsize=ORDER_QUEUE_SIZE)
+    pending = set()  # Coins with an order queued or in flight
+    worker = None
     
     logger.info(f"Monitoring coins: {', '.join(COINS)}")
-    logger.info(f"Buy condition: {PRICE_DROP_THRESHOLD*100}% price drop, Buy amount: ${AMOUNT_TO_BUY}")
-    logger.info(f"Sell condition: {PRICE_RISE_THRESHOLD*100}% price rise from buy price")
-    
-    # Get initial prices if we don't have reference prices
-    if not state['reference_prices']:
-        logger.info("Getting initial prices...")
-        current_prices = get_current_prices(exchange, COINS)
-        for coin, price in current_prices.items():
-            state['reference_prices'][coin] = price
-        save_state(state)
+    logger.info(f"Buy condition: {cfg.drop*100}% price drop, Buy amount: ${cfg.amount}")
+    logger.info(f"Sell condition: {cfg.rise*100}% price rise from buy price")
     
     try:
+        state = await load_state(store)
+        precisions = await load_amount_precisions(exchange, COINS)
+        # Only request coins that have a market; ccxt rejects the whole call otherwise
+        symbols = [SYMBOLS[coin] for coin in precisions]
+        next_markets_refresh = time.monotonic() + MARKETS_REFRESH_INTERVAL
+        
+        # Get initial prices if we don't have reference prices
+        if not state['reference_prices']:
+            logger.info("Getting initial prices...")
+            current_prices = await get_current_prices(exchange, list(precisions))
+            if current_prices:
+                state['reference_prices'].update(current_prices)
+                await save_reference_prices(store, current_prices)
+        build_triggers(state, cfg)
+        
+        # Orders run on their own task so placing one never delays the next tick
+        worker = asyncio.create_task(order_worker(exchange, state, store, cfg, order_queue, pending))
+        
+        last_prices = {}
+        next_heartbeat = time.monotonic()
         while True:
-            logger.info(f"--- {datetime.now()} ---")
+            # Refreshed before watching, so a coin that lost its market can't keep the watch failing
+            if time.monotonic() >= next_markets_refresh:
+                try:
+                    precisions = await load_amount_precisions(exchange, COINS)
+                    symbols = [SYMBOLS[coin] for coin in precisions]
+                except Exception as e:
+                    # Keep trading with the previous precisions until the next refresh
+                    logger.error(f"Error refreshing market precisions: {e}")
+                next_markets_refresh = time.monotonic() + MARKETS_REFRESH_INTERVAL
             
-            # Get current prices
-            current_prices = get_current_prices(exchange, COINS)
+            # Wait for the exchange to push ticker updates instead of polling
+            try:
+                tickers = await retry(lambda: exchange.watch_tickers(symbols), weight=0)
+            except NETWORK_ERRORS as e:
+                # Skip this tick rather than trading on a partial view of prices
+                logger.error(f"Error watching prices: {e}")
+                continue
+            except ccxt.BaseError as e:
+                # Exchange-side errors aren't retried by retry(); back off instead of stopping
+                logger.error(f"Exchange error watching prices: {e}")
+                if isinstance(e, ccxt.BadSymbol):
+                    # A market went away; reload markets now rather than at the hourly refresh
+                    next_markets_refresh = time.monotonic()
+                await asyncio.sleep(WATCH_ERROR_BACKOFF)
+                continue
+            current_prices = {
+                coin: tickers[symbol]['last']
+                for coin, symbol in SYMBOLS.items()
+                if symbol in tickers
+            }
             
-            # Check if we should buy or sell
-            state = check_trading_conditions(exchange, state, current_prices)
+            # Housekeeping runs on fixed monotonic deadlines so it doesn't drift with tick timing
+            now = time.monotonic()
+            if now >= next_heartbeat:
+                logger.info(f"--- {datetime.now()} ---")
+                next_heartbeat += cfg.interval
+                overrun = now - next_heartbeat
+                if overrun >= 0:
+                    logger.warning(f"Heartbeat overran by {overrun:.2f}s")
+                    next_heartbeat = now + cfg.interval
             
-            # Save the updated state
-            save_state(state)
-            
-            # Wait before next check
-            logger.info(f"Waiting {CHECK_INTERVAL} seconds before next check...")
-            time.sleep(CHECK_INTERVAL)
+            # Check if we should buy or sell
+            await check_trading_conditions(state, store, current_prices, last_prices, cfg, precisions, order_queue, pending)
             
-    except KeyboardInterrupt:
+    except (KeyboardInterrupt, asyncio.CancelledError):
         logger.info("Trading bot stopped by user.")
     except Exception as e:
         logger.error(f"Unexpected error: {e}", exc_info=True)
     finally:
-        logger.info("Saving final state...")
-        save_state(state)
+        if worker is not None:
+            # The decision loop has stopped, so no new intents arrive; let queued ones finish
+            if pending:
+                logger.info(f"Waiting for {len(pending)} queued order(s) to complete...")
+            try:
+                await asyncio.wait_for(order_queue.join(), ORDER_DRAIN_TIMEOUT)
+            except asyncio.TimeoutError:
+                logger.error(f"Queued orders did not complete within {ORDER_DRAIN_TIMEOUT}s")
+            worker.cancel()
+            await asyncio.gather(worker, return_exceptions=True)
+            while not order_queue.empty():
+                side, coin, amount, _ = order_queue.get_nowait()
+                logger.warning(f"Dropping queued {side} order for {amount} {coin}")
+        await store.aclose()
+        await exchange.close()
+        # ccxt doesn't close sessions it was given
+        await session.close()
         logger.info("Trading bot shut down.")
+        log_listener.stop()
 
 if __name__ == "__main__":
-    main()
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass